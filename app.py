@@ -1,111 +1,640 @@
 import streamlit as st
-import plotly.express as px
 import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
 import os
+import time
+import hashlib
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
 # --- Configurações ---
-FILE_PATH = "finances.csv"
+# Copy-on-Write: fatias e assign() compartilham memória até alguém escrever nelas.
+# É o padrão (e a opção foi descontinuada) a partir do pandas 3.0
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+FILE_PATH = "finances.parquet"
+# Lançamentos novos viram pequenos arquivos nesta pasta, sem regravar o histórico;
+# save_data() os incorpora ao FILE_PATH (compactação)
+APPEND_DIR = "finances.appends"
+MAX_APPEND_FILES = 32 # Acima disso, o próximo lançamento compacta tudo
+# Exclusões só registram o "rid" da linha aqui; load_data() as filtra na leitura
+TOMBSTONE_PATH = "finances.tombstones.parquet"
+MAX_TOMBSTONES = 1000 # Acima disso, a próxima exclusão compacta tudo
+PAGE_SIZE = 200 # Linhas de tabela enviadas ao navegador por vez
+LEGACY_CSV_PATH = "finances.csv" # Formato antigo, migrado automaticamente
+PARQUET_COMPRESSION = "zstd" # Arquivos menores que snappy, com leitura igualmente rápida
+# "rid" identifica cada linha de forma estável entre gravações (não é exibido)
+COLUMNS = ["Data", "Tipo", "Categoria", "Valor", "Descrição", "rid"]
+# Tipo como categoria: comparações e agrupamentos usam códigos int8 (0 = Receita, 1 = Despesa)
+TIPO_DTYPE = pd.CategoricalDtype(["Receita", "Despesa"])
+INCOME_CATEGORIES = ("Salário", "Investimento", "Freelance", "Presente", "Vendas", "Outros")
+EXPENSE_CATEGORIES = ("Alimentação", "Transporte", "Moradia", "Lazer", "Saúde", "Educação", "Contas", "Compras", "Outros")
+CATEGORIES_BY_TYPE = {"Receita": INCOME_CATEGORIES, "Despesa": EXPENSE_CATEGORIES}
+# Categoria também é categórica; "Outros" aparece nas duas listas, mas entra uma vez só
+CATEGORIA_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(INCOME_CATEGORIES + EXPENSE_CATEGORIES)))
+# Descrição em texto do Arrow (buffer contíguo), não objetos Python; no pandas 3 o "str"
+# padrão já é Arrow e a conversão não copia os dados
+DESCRICAO_DTYPE = pd.StringDtype("pyarrow")
+# Meses como categoria ordenada: agrupa por códigos inteiros e já sai na ordem do calendário
+MONTH_CAT = pd.CategoricalDtype(
+    ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez'],
+    ordered=True
+)
+MONTH_ORDER = MONTH_CAT.categories.tolist() # Ordem dos meses nos eixos do Plotly
 
 # --- Funções de Ajuda ---
+# Troca "," por "." e vice-versa em uma única passada (1,234.56 -> 1.234,56)
+_BRL_SEPARATORS = str.maketrans({",": ".", ".": ","})
+
 def format_currency(value):
     """Formata um valor numérico para o formato de moeda brasileira (R$)."""
     # Garante que o valor é um número antes de formatar
     if pd.isna(value):
         return ""
-    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"R$ {value:,.2f}".translate(_BRL_SEPARATORS)
+
+def format_currency_series(values):
+    """Versão vetorizada de format_currency para uma Series inteira."""
+    # astype(str): numa Series vazia o map devolve float, sem o acessor .str
+    formatted = "R$ " + values.map("{:,.2f}".format).astype(str).str.translate(_BRL_SEPARATORS)
+    return formatted.where(values.notna(), "")
+
+def _as_categoria(values):
+    """Converte a coluna Categoria para categoria sem descartar valores fora das listas."""
+    extras = pd.Index(values.dropna().unique()).difference(CATEGORIA_DTYPE.categories)
+    if extras.empty:
+        return values.astype(CATEGORIA_DTYPE)
+    # Categorias antigas/editadas à mão entram no fim, para não virarem NaN
+    return values.astype(pd.CategoricalDtype(CATEGORIA_DTYPE.categories.tolist() + extras.tolist()))
+
+def paginate(frame, key):
+    """Retorna uma página de PAGE_SIZE linhas, com seletor quando há mais de uma."""
+    pages = -(-len(frame) // PAGE_SIZE) # Divisão arredondada para cima
+    if pages <= 1:
+        return frame
+    page = st.number_input("Página", min_value=1, max_value=pages, value=1, step=1, key=key)
+    st.caption(f"Página {page} de {pages} ({len(frame)} transações).")
+    start = (page - 1) * PAGE_SIZE
+    return frame.iloc[start:start + PAGE_SIZE]
+
+def _set_state(name, value):
+    """Callback de botão: grava no state antes do rerun que o próprio clique dispara."""
+    st.session_state[name] = value
 
 # --- Funções de Dados ---
-def load_data():
-    # ... (Resto da função load_data)
-    """Carrega os dados do arquivo CSV ou cria um DataFrame vazio."""
-    if os.path.exists(FILE_PATH):
+def _empty_frame():
+    """Retorna um DataFrame vazio com as colunas e tipos esperados."""
+    return pd.DataFrame(columns=COLUMNS).astype({
+        "Data": "datetime64[ns]", "Tipo": TIPO_DTYPE, "Categoria": CATEGORIA_DTYPE, "Valor": "float64",
+        "Descrição": DESCRICAO_DTYPE, "rid": "int64"
+    })
+
+def _write_parquet(df, path):
+    """Grava o Parquet num arquivo temporário e o move para `path` de uma vez.
+
+    Uma gravação interrompida deixa só o .tmp para trás, nunca um Parquet truncado.
+    """
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False, compression=PARQUET_COMPRESSION)
+    os.replace(tmp_path, path)
+
+def _migrate_legacy_csv():
+    """Converte o antigo finances.csv para Parquet, uma única vez."""
+    if os.path.exists(FILE_PATH) or not os.path.exists(LEGACY_CSV_PATH):
+        return
+    try:
+        # Leitor multithread do Arrow; Tipo/Categoria seguem como texto comum
+        df = pd.read_csv(LEGACY_CSV_PATH, engine="pyarrow")
+    except Exception as e:
+        st.error(f"Erro ao migrar dados: {e}")
+        return
+    # O CSV não guarda tipos: converte uma última vez antes de gravar o Parquet
+    # Única conversão de datas do app: daqui em diante o tipo datetime é preservado
+    # O app sempre gravou as datas em ISO 8601: o formato explícito usa o caminho rápido
+    df["Data"] = pd.to_datetime(df["Data"], format="ISO8601", errors="coerce", cache=True)
+    df["Valor"] = pd.to_numeric(df["Valor"], errors="coerce").fillna(0)
+    df["Tipo"] = df["Tipo"].astype(TIPO_DTYPE)
+    df["Categoria"] = _as_categoria(df["Categoria"])
+    df["Descrição"] = df["Descrição"].astype(DESCRICAO_DTYPE)
+    # add_transaction conta com o histórico ordenado por Data (NaT no final)
+    df = df.sort_values(by="Data", kind="mergesort", ignore_index=True)
+    df["rid"] = np.arange(len(df), dtype="int64")
+    _write_parquet(df, FILE_PATH)
+
+def _append_files():
+    """Lista os arquivos de lançamentos pendentes de compactação, em ordem de gravação."""
+    if not os.path.isdir(APPEND_DIR):
+        return []
+    return [os.path.join(APPEND_DIR, name) for name in sorted(os.listdir(APPEND_DIR)) if name.endswith(".parquet")]
+
+def _tombstones():
+    """Retorna os rids excluídos e ainda não compactados."""
+    if not os.path.exists(TOMBSTONE_PATH):
+        return np.empty(0, dtype="int64")
+    return pd.read_parquet(TOMBSTONE_PATH, engine="pyarrow")["rid"].to_numpy()
+
+def _tombstone_count():
+    """Quantidade de exclusões pendentes, lida só dos metadados do Parquet."""
+    if not os.path.exists(TOMBSTONE_PATH):
+        return 0
+    return pq.read_metadata(TOMBSTONE_PATH).num_rows
+
+def _load_failed():
+    """Indica se a carga desta sessão deixou arquivos sem ler.
+
+    Nesse caso o DataFrame em memória está incompleto e nada pode regravar o histórico
+    inteiro (compactação), senão as linhas não lidas se perderiam.
+    """
+    return bool(st.session_state.get("load_errors"))
+
+def _data_version():
+    """mtime mais recente entre o arquivo principal, a pasta de lançamentos e as exclusões."""
+    paths = [path for path in (FILE_PATH, APPEND_DIR, TOMBSTONE_PATH) if os.path.exists(path)]
+    return max((os.path.getmtime(path) for path in paths), default=0.0)
+
+# Uma única versão dos dados fica em memória: um mtime novo substitui a entrada antiga.
+# persist="disk" mantém essa versão entre reinícios do servidor (o mtime continua válido)
+@st.cache_data(show_spinner=False, max_entries=1, persist="disk")
+def _load_data(mtime: float):
+    """Lê o Parquet e os lançamentos pendentes; o cache é invalidado quando o mtime muda.
+
+    Retorna o DataFrame e a lista de arquivos que não puderam ser lidos.
+    """
+    frames = []
+    errors = []
+    for path in ([FILE_PATH] if os.path.exists(FILE_PATH) else []) + _append_files():
         try:
-            df = pd.read_csv(FILE_PATH)
+            # O Parquet preserva os tipos (datetime, float, categoria), sem conversões na leitura
+            frames.append(pd.read_parquet(path, engine="pyarrow"))
         except Exception as e:
-            st.error(f"Erro ao carregar dados: {e}")
-            df = pd.DataFrame(columns=["Data", "Tipo", "Categoria", "Valor", "Descrição"])
-    else:
-        df = pd.DataFrame(columns=["Data", "Tipo", "Categoria", "Valor", "Descrição"])
-        
-    # Garante que a coluna Data é do tipo datetime, tratando erros
-    df["Data"] = pd.to_datetime(df["Data"], errors="coerce")
-    # Garante que a coluna Valor é numérica
-    df["Valor"] = pd.to_numeric(df["Valor"], errors="coerce").fillna(0)
-    return df
+            # Um arquivo ruim não descarta os demais: é reportado e ignorado
+            st.error(f"Erro ao carregar {path}: {e}")
+            errors.append(path)
+    try:
+        tombstones = _tombstones()
+    except Exception as e:
+        st.error(f"Erro ao carregar {TOMBSTONE_PATH}: {e}")
+        errors.append(TOMBSTONE_PATH)
+        tombstones = np.empty(0, dtype="int64")
+    if not frames:
+        return _empty_frame(), errors
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    # Sem custo se já for categoria; converte arquivos gravados antes dessa mudança
+    df["Tipo"] = df["Tipo"].astype(TIPO_DTYPE)
+    df["Categoria"] = _as_categoria(df["Categoria"])
+    df["Descrição"] = df["Descrição"].astype(DESCRICAO_DTYPE)
+    if len(frames) > 1:
+        # Os lançamentos pendentes podem ter datas anteriores ao histórico
+        df = df.sort_values(by="Data", kind="mergesort", ignore_index=True)
+    if len(tombstones):
+        df = df[~df["rid"].isin(tombstones)].reset_index(drop=True)
+    return df, errors
+
+def _migrate_row_ids():
+    """Atribui a coluna "rid" a arquivos gravados antes dela, uma única vez."""
+    paths = ([FILE_PATH] if os.path.exists(FILE_PATH) else []) + _append_files()
+    try:
+        # Só lê o esquema (rodapé do Parquet), não os dados
+        if all("rid" in pq.read_schema(path).names for path in paths):
+            return
+    except Exception:
+        # Arquivo ilegível (ex.: gravação interrompida): _load_data() o reporta, e a
+        # migração espera até que todos possam ser lidos
+        return
+    df, errors = _load_data(_data_version())
+    if errors:
+        return # save_data() regravaria o histórico sem as linhas que não foram lidas
+    save_data(df.assign(rid=np.arange(len(df), dtype="int64")))
+
+def load_data():
+    # ... (Resto da função load_data)
+    """Carrega os dados do arquivo Parquet ou cria um DataFrame vazio.
+
+    Retorna o DataFrame e a lista de arquivos que não puderam ser lidos.
+    """
+    _migrate_legacy_csv()
+    _migrate_row_ids()
+    return _load_data(_data_version())
 
 def save_data(df):
     # ... (Resto da função save_data)
-    """Salva o DataFrame no arquivo CSV."""
-    df.to_csv(FILE_PATH, index=False)
+    """Salva o DataFrame inteiro no arquivo Parquet e descarta lançamentos e exclusões pendentes."""
+    _write_parquet(df, FILE_PATH)
+    for path in _append_files():
+        os.remove(path)
+    # As linhas excluídas já não estão em df
+    if os.path.exists(TOMBSTONE_PATH):
+        os.remove(TOMBSTONE_PATH)
+    # Invalida o cache de leitura para a próxima carga refletir o arquivo novo
+    _load_data.clear()
+
+def append_rows(new_df):
+    """Grava só as linhas novas, em um arquivo próprio, sem regravar o histórico."""
+    os.makedirs(APPEND_DIR, exist_ok=True)
+    _write_parquet(new_df, os.path.join(APPEND_DIR, f"{time.time_ns()}.parquet"))
+    _load_data.clear()
+
+def _monthly_dates(date, parcelas):
+    """Gera as datas de `parcelas` meses seguidos a partir de `date`, de uma só vez.
+
+    Mesma regra do relativedelta: o dia é limitado ao fim de cada mês (31/01 -> 29/02 -> 31/03).
+    """
+    start = np.datetime64(date, "D")
+    first_month = start.astype("datetime64[M]")
+    months = first_month + np.arange(parcelas)
+    month_starts = months.astype("datetime64[D]")
+    month_lengths = ((months + 1).astype("datetime64[D]") - month_starts).astype(int)
+    day_offset = (start - first_month.astype("datetime64[D]")).astype(int)
+    return pd.DatetimeIndex(month_starts + np.minimum(day_offset, month_lengths - 1))
+
+def _insert_sorted(df, new_df):
+    """Insere new_df (já em ordem de data) em df, mantendo a ordenação por Data.
+
+    Usa busca binária para achar a posição de cada linha nova, em vez de reordenar
+    o histórico inteiro: O(k log n) para localizar e uma única cópia O(n + k).
+    """
+    n = len(df)
+    # Caso mais comum: lançamento a partir da data mais recente, basta anexar ao final
+    last = df["Data"].iloc[-1] if n else None
+    if n == 0 or (pd.notna(last) and new_df["Data"].iloc[0] >= last):
+        return pd.concat([df, new_df], ignore_index=True)
+    # Datas inválidas (NaT) ficam no final do histórico; a busca considera só as válidas
+    n_valid = int(df["Data"].notna().sum())
+    positions = df["Data"].iloc[:n_valid].searchsorted(new_df["Data"], side="right")
+    if positions[0] == positions[-1]:
+        # Todas as parcelas caem no mesmo ponto: um único bloco entre duas fatias,
+        # numa só cópia, sem montar o concat intermediário
+        pos = int(positions[0])
+        return pd.concat([df.iloc[:pos], new_df, df.iloc[pos:]], ignore_index=True)
+    order = np.insert(np.arange(n), positions, np.arange(n, n + len(new_df)))
+    # Como nos outros caminhos, o resultado volta com índice 0..n-1
+    return pd.concat([df, new_df], ignore_index=True).iloc[order].reset_index(drop=True)
 
 def add_transaction(df, date, type, category, value, description, parcelas=1):
     # ... (Resto da função add_transaction)
     """Adiciona uma transação, com suporte a parcelamento."""
-    new_rows = []
-    # Cria uma linha para cada parcela
-    for i in range(parcelas):
-        parcela_date = date + relativedelta(months=i)
-        desc = description
-        if parcelas > 1:
-            desc += f" ({i+1}/{parcelas})"
-        new_rows.append({
-            "Data": parcela_date,
-            "Tipo": type,
-            "Categoria": category,
-            "Valor": value,
-            "Descrição": desc
-        })
-    new_df = pd.DataFrame(new_rows)
-    df = pd.concat([df, new_df], ignore_index=True)
-    df["Data"] = pd.to_datetime(df["Data"], errors="coerce")
-    df.sort_values(by="Data", inplace=True) 
-    save_data(df)
+    # Todas as parcelas são montadas em colunas, sem laço de dicionários por linha
+    if parcelas > 1:
+        descriptions = [f"{description} ({i+1}/{parcelas})" for i in range(parcelas)]
+    else:
+        descriptions = [description]
+    new_df = pd.DataFrame({
+        "Data": _monthly_dates(date, parcelas),
+        # Mesmos tipos categóricos do histórico, para o concat não voltar a object
+        "Tipo": pd.Categorical(np.repeat(type, parcelas), dtype=TIPO_DTYPE),
+        "Categoria": pd.Categorical(np.repeat(category, parcelas), dtype=df["Categoria"].dtype),
+        "Valor": np.full(parcelas, value, dtype="float64"),
+        "Descrição": pd.array(descriptions, dtype=DESCRICAO_DTYPE),
+        # Nanossegundos da gravação: únicos e sempre maiores que os rids anteriores
+        "rid": time.time_ns() + np.arange(parcelas, dtype="int64")
+    })
+    df = _insert_sorted(df, new_df)
+    if len(_append_files()) < MAX_APPEND_FILES or _load_failed():
+        append_rows(new_df) # Escrita proporcional às parcelas, não ao histórico
+    else:
+        save_data(df)
+    clear_analysis_caches()
     return df
 
-def delete_transaction(df, index):
+def delete_transaction(df, rid):
     # ... (Resto da função delete_transaction)
-    """Exclui uma transação pelo índice."""
-    df = df.drop(index).reset_index(drop=True)
-    save_data(df)
+    """Exclui uma transação pelo seu "rid"."""
+    tombstones = np.append(_tombstones(), rid)
+    # Pelo rid, não pelo rótulo do índice: o rótulo não identifica a linha entre sessões
+    df = df[df["rid"] != rid].reset_index(drop=True)
+    if len(tombstones) <= MAX_TOMBSTONES or _load_failed():
+        # Regrava só a lista de rids excluídos, não o histórico
+        _write_parquet(pd.DataFrame({"rid": tombstones}), TOMBSTONE_PATH)
+        _load_data.clear()
+    else:
+        save_data(df)
+    clear_analysis_caches()
     return df
 
 def get_categories(transaction_type):
     # ... (Resto da função get_categories)
     """Retorna as categorias baseadas no tipo de transação."""
-    income_categories = ["Salário", "Investimento", "Freelance", "Presente", "Vendas", "Outros"]
-    expense_categories = ["Alimentação", "Transporte", "Moradia", "Lazer", "Saúde", "Educação", "Contas", "Compras", "Outros"]
+    return CATEGORIES_BY_TYPE[transaction_type]
+
+# --- Funções de Análise ---
+def _fingerprint(df):
+    """Chave da versão dos dados: linhas, data mais recente, soma dos valores e quais linhas são.
+
+    Os caches de recurso são compartilhados por todas as sessões, então a chave precisa
+    identificar as linhas (rid) e seus rótulos de índice, e não só os totais.
+    """
+    # Só escalares nativos e um digest curto: o hash do Streamlit é imediato, sem serializar
+    # Timestamp/NaT; as funções em cache recebem o DataFrame como `_df`, fora do hash
+    latest = df["Data"].max()
+    rows = hashlib.blake2b(np.ascontiguousarray(df["rid"].to_numpy()).tobytes(), digest_size=16)
+    rows.update(np.ascontiguousarray(df.index.to_numpy()).tobytes())
+    return (len(df), 0 if pd.isna(latest) else latest.value, float(df["Valor"].sum()), rows.hexdigest())
+
+# Frames e figuras derivados ficam em st.cache_resource (aqui e abaixo): todas as sessões
+# recebem o mesmo objeto, sem cópia via pickle a cada rerun. Por isso a chave precisa
+# identificar as linhas (_fingerprint) e ninguém pode alterar o objeto devolvido: quem
+# precisa de outra versão usa assign()/reset_index(), que criam um DataFrame novo
+@st.cache_resource(show_spinner=False)
+def _enrich(key, _df):
+    """Calcula as colunas derivadas uma única vez por versão dos dados (chave `key`)."""
+    # Remove linhas com 'Data' inválida (coerção falhou); sem NaT, nem copia
+    df = _df.dropna(subset=["Data"]) if _df["Data"].hasnans else _df
+    # Uma única passada sobre as datas: meses desde 1970 -> ano (int16) e mês (0-11)
+    months = df["Data"].values.astype("datetime64[M]").astype("int64")
+    df = df.assign(
+        Ano=(months // 12 + 1970).astype("int16"),
+        Mês=pd.Categorical.from_codes((months % 12).astype("int8"), dtype=MONTH_CAT),
+    )
+    # O histórico já é mantido em ordem crescente de Data: basta inverter a visão
+    if df["Data"].is_monotonic_increasing:
+        return df.iloc[::-1]
+    return df.sort_values(by="Data", ascending=False)
+
+def enrich(df):
+    """Retorna o DataFrame com as colunas derivadas usadas pelas páginas."""
+    # Chave barata: evita que o Streamlit percorra o DataFrame inteiro para gerar o hash
+    return _enrich(_fingerprint(df), df)
+
+# As agregações abaixo recebem o DataFrame já enriquecido como `_df` (não entra no hash)
+# e são reaproveitadas entre páginas enquanto a chave `key` não mudar.
+@st.cache_data(show_spinner=False)
+def totals_agg(key, _df):
+    """Total de receitas, total de despesas e saldo."""
+    # Uma única passada do NumPy pelos códigos do Tipo (-1 = sem tipo, vai para a posição 0)
+    sums = np.bincount(_df["Tipo"].cat.codes.to_numpy() + 1, weights=_df["Valor"].to_numpy(), minlength=3)
+    total_income = float(sums[1]) # Receita
+    total_expense = float(sums[2]) # Despesa
+    # Saldo: como em cumulative_agg, linhas sem tipo também subtraem
+    return total_income, total_expense, total_income - total_expense - float(sums[0])
+
+@st.cache_data(show_spinner=False)
+def cumulative_agg(key, _df):
+    """Receita, despesa e saldo acumulados por dia, em ordem cronológica."""
+    # enrich() entrega as linhas da mais recente para a mais antiga: basta inverter a visão
+    dates = _df["Data"].values[::-1]
+    codes = _df["Tipo"].cat.codes.values[::-1] # 0 = Receita, 1 = Despesa
+    val = _df["Valor"].values[::-1]
+    columns = {
+        "Receita Acumulada": np.where(codes == 0, val, 0.0),
+        "Despesa Acumulada": np.where(codes == 1, val, 0.0),
+        # Saldo: receitas somam, todo o resto subtrai
+        "Saldo Cumulativo": np.where(codes == 0, val, -val),
+    }
+    if len(dates) == 0:
+        return pd.DataFrame({"Data": dates, **columns})
+    # Com as datas ordenadas, cada dia é um trecho contíguo: soma por trecho
+    # (reduceat) e acumula, numa única passada e sem a máquina genérica do groupby
+    starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+    out = {"Data": dates[starts]}
+    for name, values in columns.items():
+        out[name] = np.add.reduceat(values, starts).cumsum()
+    return pd.DataFrame(out)
+
+@st.cache_data(show_spinner=False)
+def monthly_agg(key, _df):
+    """Soma dos valores por ano, mês e tipo."""
+    # Mantém sort=True: as facetas por Ano saem na ordem em que aparecem nos dados
+    return _df.groupby(["Ano", "Mês", "Tipo"], observed=True)["Valor"].sum().reset_index()
+
+@st.cache_data(show_spinner=False)
+def yearly_agg(key, _df):
+    """Soma dos valores por ano e tipo."""
+    return _df.groupby(["Ano", "Tipo"], observed=True, sort=False)["Valor"].sum().reset_index()
+
+@st.cache_data(show_spinner=False)
+def _category_totals(key, _df):
+    """Soma dos valores por tipo e categoria, numa única passada para os dois tipos."""
+    return _df.groupby(["Tipo", "Categoria"], observed=True, sort=False)["Valor"].sum()
+
+@st.cache_data(show_spinner=False)
+def category_agg(key, _df, tipo):
+    """Soma dos valores por categoria para o tipo de transação informado."""
+    totals = _category_totals(key, _df)
+    # Sem máscara sobre o DataFrame inteiro: seleciona o tipo no resultado agrupado
+    if tipo not in totals.index.get_level_values("Tipo"):
+        return pd.DataFrame({"Categoria": pd.Series(dtype=_df["Categoria"].dtype), "Valor": pd.Series(dtype="float64")})
+    return totals.xs(tipo, level="Tipo").reset_index()
+
+# --- Gráficos ---
+# As figuras também ficam em cache pela chave dos dados: trocar de página ou de
+# submenu reaproveita a figura pronta em vez de remontá-la com o Plotly Express.
+# O Plotly é importado dentro de cada função: páginas sem gráficos (Lançamento,
+# Histórico) não pagam a importação na primeira execução do servidor
+TYPE_COLORS = {"Receita": "#1E90FF", "Despesa": "#DC143C"}
+CUMULATIVE_COLORS = {
+    'Receita Acumulada': '#1E90FF',  # Azul (Receita)
+    'Despesa Acumulada': '#DC143C',  # Vermelho (Despesa)
+    'Saldo Cumulativo': '#2E8B57'   # Verde (Saldo)
+}
+
+@st.cache_resource(show_spinner=False)
+def cumulative_fig(key, _df):
+    """Gráfico de linha com receita, despesa e saldo acumulados."""
+    import plotly.express as px
+    # Derreter (melt) os dados para plotar múltiplas linhas com Plotly Express
+    df_melt = cumulative_agg(key, _df).melt(
+        id_vars=['Data'],
+        value_vars=['Receita Acumulada', 'Despesa Acumulada', 'Saldo Cumulativo'],
+        var_name='Métrica',
+        value_name='Valor'
+    )
+    fig = px.line(
+        df_melt,
+        x="Data",
+        y="Valor",
+        color="Métrica", # Usa a métrica para diferenciar as linhas
+        title="Evolução Financeira Acumulativa",
+        markers=True,
+        color_discrete_map=CUMULATIVE_COLORS
+    )
+    fig.update_layout(
+        height=350, 
+        margin=dict(t=50, b=10, l=10, r=10),
+        xaxis_title="Data",
+        yaxis_title="Valor Acumulado (R$)",
+        hovermode="x unified"
+    )
+    fig.update_traces(line=dict(width=3))
+    return fig
+
+@st.cache_resource(show_spinner=False)
+def monthly_fig(key, _df, title=None):
+    """Barras agrupadas de receitas e despesas por mês, uma faceta por ano."""
+    import plotly.express as px
+    fig = px.bar(
+        monthly_agg(key, _df),
+        x="Mês",
+        y="Valor",
+        color="Tipo",
+        barmode="group",
+        facet_col="Ano",
+        title=title,
+        color_discrete_map=TYPE_COLORS,
+        category_orders={"Mês": MONTH_ORDER}
+    )
+    fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10), uniformtext_minsize=8, uniformtext_mode='hide')
+    fig.update_yaxes(title_text="Valor (R$)") # Adiciona rótulo ao eixo Y
+    return fig
+
+@st.cache_resource(show_spinner=False)
+def yearly_fig(key, _df):
+    """Barras agrupadas de receitas e despesas por ano."""
+    import plotly.express as px
+    fig = px.bar(
+        yearly_agg(key, _df),
+        x="Ano",
+        y="Valor",
+        color="Tipo",
+        barmode="group",
+        color_discrete_map=TYPE_COLORS,
+    )
+    fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10), uniformtext_minsize=8, uniformtext_mode='hide')
+    fig.update_yaxes(title_text="Valor (R$)")
+    return fig
+
+@st.cache_resource(show_spinner=False)
+def category_fig(key, _df, tipo, title=None):
+    """Gráfico de pizza da distribuição por categoria do tipo informado."""
+    import plotly.express as px
+    fig = px.pie(
+        category_agg(key, _df, tipo),
+        values="Valor",
+        names="Categoria",
+        title=title,
+        hole=0.3,
+        color_discrete_sequence=px.colors.sequential.Blues if tipo == "Receita" else px.colors.sequential.Reds
+    )
+    fig.update_traces(textinfo='percent+label') # Mostra porcentagem e rótulo no gráfico
+    fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10))
+    return fig
+
+@st.cache_resource(show_spinner=False)
+def _tipo_frames(key, _df):
+    """Linhas de cada tipo de transação, separadas numa única passada."""
+    parts = dict(list(_df.groupby("Tipo", observed=True, sort=False)))
+    return {tipo: parts.get(tipo, _df.iloc[:0]) for tipo in TIPO_DTYPE.categories}
+
+@st.cache_resource(show_spinner=False)
+def tipo_detail(key, _df, tipo):
+    """Linhas do tipo informado, com o Valor já formatado para a tabela de detalhes."""
+    rows = _tipo_frames(key, _df)[tipo]
+    return rows.assign(Valor=format_currency_series(rows["Valor"]))
+
+@st.cache_resource(show_spinner=False)
+def history_display(key, _df, n):
+    """As `n` transações mais recentes, prontas para a tabela do Histórico."""
+    # _df já vem da mais recente para a mais antiga, então head() basta, sem reordenar
+    visible = _df.head(n)
+    # "ID" é a posição da linha no histórico (0 = mais antiga), calculada das próprias
+    # linhas e não dos rótulos do índice; a exclusão usa o "rid". Só o Valor é formatado
+    # aqui; a Data segue como datetime e é formatada pelo navegador
+    ids = np.arange(len(_df) - 1, len(_df) - 1 - len(visible), -1)
+    return visible.assign(ID=ids, Valor=format_currency_series(visible["Valor"]))
+
+def clear_analysis_caches():
+    """Descarta as agregações e figuras das versões anteriores dos dados (chamada após cada gravação)."""
+    for cached in (_enrich, totals_agg, cumulative_agg, monthly_agg, yearly_agg, _category_totals, category_agg,
+                   cumulative_fig, monthly_fig, yearly_fig, category_fig, _tipo_frames, tipo_detail,
+                   history_display):
+        cached.clear()
+
+# --- Fragmentos ---
+@st.fragment
+def history_section(df, key):
+    """Tabela do histórico e exclusão de transações.
+
+    Como fragmento, "Carregar mais" e a troca do ID selecionado reexecutam só esta
+    seção; a exclusão chama st.rerun(), que reexecuta o app inteiro.
+    """
+    # Só as transações mais recentes vão para o navegador; a página formatada fica em
+    # cache, então trocar o ID selecionado não a refaz
+    df_display = history_display(key, df, st.session_state.hist_n)
+    history_columns = ["ID", "Data", "Tipo", "Categoria", "Valor", "Descrição"]
+    column_config = {"Data": st.column_config.DateColumn(format="DD/MM/YYYY")}
+
+    # Exibe o histórico de transações
+    st.dataframe(df_display, 
+                 column_order=history_columns,
+                 column_config=column_config,
+                 hide_index=True,
+                 use_container_width=True, 
+                 height=250)
+
+    if len(df_display) < len(df):
+        st.caption(f"Exibindo {len(df_display)} de {len(df)} transações.")
+        st.button("Carregar mais", key="load_more_button",
+                  on_click=_set_state, args=("hist_n", st.session_state.hist_n + PAGE_SIZE))
+
+    st.markdown("---")
     
-    if transaction_type == "Receita":
-        return income_categories
+    st.caption("🗑️ Excluir Transação")
+    
+    # A seleção guarda o rid (identificador estável da linha); o ID exibido é só o rótulo
+    id_labels = dict(zip(df_display["rid"].tolist(), df_display["ID"].tolist()))
+    
+    if id_labels:
+        # Seleciona o ID do topo
+        selected_rid = st.selectbox("Selecione o ID da transação:", list(id_labels), index=0,
+                                    format_func=lambda rid: str(id_labels[rid]))
+        
+        selected_row = df_display[df_display["rid"] == selected_rid]
+        st.caption("Transação selecionada (Confirmação):")
+        # Exibe a transação selecionada para confirmação (altura menor)
+        st.dataframe(selected_row, 
+                     column_order=history_columns,
+                     column_config=column_config,
+                     hide_index=True,
+                     use_container_width=True, 
+                     height=50)
+
+        # Com a lista de exclusões ilegível, gravar outra por cima perderia as anteriores
+        tombstones_lost = TOMBSTONE_PATH in st.session_state.load_errors
+        if tombstones_lost:
+            st.caption("Exclusão desativada: a lista de exclusões pendentes não pôde ser lida.")
+        if st.button("Excluir Transação", type="secondary", key="delete_button", disabled=tombstones_lost):
+            st.session_state.df = delete_transaction(st.session_state.df, selected_rid) 
+            st.success("Transação excluída com sucesso!")
+            st.rerun()
+    else:
+        st.info("Nenhuma transação disponível para exclusão.")
+
+    # Lançamentos e exclusões pendentes são incorporados automaticamente (MAX_APPEND_FILES,
+    # MAX_TOMBSTONES); o botão permite compactar antes disso
+    if _load_failed():
+        # O histórico em memória está incompleto: compactar gravaria só o que foi lido
+        st.markdown("---")
+        st.warning("Compactação desativada: alguns arquivos de dados não puderam ser lidos nesta sessão.")
     else:
-        return expense_categories
+        pending_appends, pending_deletes = len(_append_files()), _tombstone_count()
+        if pending_appends or pending_deletes:
+            st.markdown("---")
+            st.caption(f"🗜️ Compactação: {pending_appends} lançamento(s) e {pending_deletes} exclusão(ões) pendentes.")
+            if st.button("Compactar", type="secondary", key="compact_button"):
+                save_data(st.session_state.df)
+                st.success("Dados compactados com sucesso!")
+                st.rerun()
 
 # --- Layout ---
 st.set_page_config(page_title="Gestor Financeiro", page_icon="💰", layout="wide")
 
 # --- Inicialização do State ---
 if "df" not in st.session_state:
-    st.session_state.df = load_data()
+    # Arquivos que não puderam ser lidos ficam registrados para a sessão
+    st.session_state.df, st.session_state.load_errors = load_data()
 if "page" not in st.session_state:
     st.session_state.page = "lancamento" # Inicia em Lançamentos
 if "analise_tipo" not in st.session_state:
     st.session_state.analise_tipo = "despesas"
 if "transaction_type" not in st.session_state:
     st.session_state.transaction_type = "Receita"
+if "hist_n" not in st.session_state:
+    st.session_state.hist_n = PAGE_SIZE # Linhas visíveis no Histórico
 
 # --- Dados ---
-df = st.session_state.df.copy()
-# Remove linhas com 'Data' inválida (coerção falhou)
-df = df.dropna(subset=["Data"]) 
-df["Data"] = pd.to_datetime(df["Data"]) # Garantindo o tipo datetime
-
-# Cria colunas de sinal e valor ajustado (para saldo e gráficos)
-if not df.empty:
-    df["Sinal"] = df["Tipo"].apply(lambda x: 1 if x == "Receita" else -1)
-    df["Valor Ajustado"] = df["Valor"] * df["Sinal"]
-    df.sort_values(by="Data", ascending=False, inplace=True)
+# Sem cópia: enrich() não altera o DataFrame do state e devolve um novo com as
+# colunas de ano e mês (para os gráficos)
+df = enrich(st.session_state.df)
+data_key = _fingerprint(df) # Chave das agregações em cache
 
 
 # ----------------------------------------------------------------------------------
@@ -123,28 +652,43 @@ pages = {
     "📅 Histórico": "historico"
 }
 
+# SOLUÇÃO JAVASCRIPT: recolhe a sidebar (modo móvel) depois de um clique nos botões dela.
+# st.html roda o script no próprio documento da página (sem iframe); o ouvinte é
+# instalado uma vez, e reinstalar troca o anterior, para nunca haver dois ouvintes ativos
+COLLAPSE_SIDEBAR_JS = """
+<script>
+    function collapseSidebar() {
+        // Botão "<<" do cabeçalho da sidebar
+        const closeButton = document.querySelector('[data-testid="stSidebarCollapseButton"] button');
+        if (closeButton) {
+            closeButton.click();
+        }
+    }
+    function onSidebarClick(event) {
+        // Só em tela estreita, onde a sidebar cobre o conteúdo
+        if (window.matchMedia("(max-width: 768px)").matches &&
+                event.target.closest('[data-testid="stSidebarUserContent"] button')) {
+            setTimeout(collapseSidebar, 50);
+        }
+    }
+    if (document.__collapseSidebarListener) {
+        document.removeEventListener("click", document.__collapseSidebarListener);
+    }
+    document.__collapseSidebarListener = onSidebarClick;
+    document.addEventListener("click", onSidebarClick);
+</script>
+"""
+
 # Cria os botões de navegação no sidebar
 for label, key in pages.items():
     button_type = "primary" if st.session_state.page == key else "secondary"
     
-    if st.sidebar.button(label, use_container_width=True, type=button_type):
-        st.session_state.page = key
-        
-        # SOLUÇÃO JAVASCRIPT: Força o recolhimento da sidebar em modo móvel
-        st.markdown("""
-        <script>
-            function collapseSidebar() {
-                const closeButton = document.querySelector('button[aria-label="Close sidebar"]') ||
-                                     document.querySelector('button[aria-label="Fechar Menu"]');
-                if (closeButton) {
-                    closeButton.click();
-                }
-            }
-            setTimeout(collapseSidebar, 50);
-        </script>
-        """, unsafe_allow_html=True)
-        
-        st.rerun() 
+    # O callback troca a página antes do rerun do clique, sem precisar de st.rerun();
+    # o botão da página atual fica desabilitado, então clicá-lo não dispara rerun
+    st.sidebar.button(label, use_container_width=True, type=button_type, disabled=st.session_state.page == key,
+                      on_click=_set_state, args=("page", key))
+
+st.sidebar.html(COLLAPSE_SIDEBAR_JS, unsafe_allow_javascript=True)
     
 st.sidebar.markdown("---")
 st.sidebar.caption("Gestor Financeiro v1.0")
@@ -175,95 +719,29 @@ with main_col:
         if df.empty:
             st.info("Nenhuma transação registrada ainda.")
         else:
-            # Cálculo das métricas
-            total_balance = df["Valor Ajustado"].sum()
-            total_income = df[df["Tipo"] == "Receita"]["Valor"].sum()
-            total_expense = df[df["Tipo"] == "Despesa"]["Valor"].sum()
+            # Cálculo das métricas (em cache)
+            total_income, total_expense, total_balance = totals_agg(data_key, df)
             
-            # Exibição das métricas em 3 colunas para preencher o espaço principal
-            col_b, col_i, col_e = st.columns(3)
-
-            with col_b:
-                st.markdown(
-                    f"<div style='background:#2E8B57;padding:15px;border-radius:10px;text-align:center;color:white; margin-bottom: 5px;'>"
-                    f"<h4 style='margin:0;font-size:14px;'>💰 Saldo Total</h4><h3 style='margin:0;font-size:20px;'>{format_currency(total_balance)}</h3></div>",
-                    unsafe_allow_html=True,
-                )
-            with col_i:
-                st.markdown(
-                    f"<div style='background:#1E90FF;padding:15px;border-radius:10px;text-align:center;color:white; margin-bottom: 5px;'>"
-                    f"<h4 style='margin:0;font-size:14px;'>⬆️ Total de Receitas</h4><h3 style='margin:0;font-size:20px;'>{format_currency(total_income)}</h3></div>",
-                    unsafe_allow_html=True,
-                )
-            with col_e:
-                st.markdown(
-                    f"<div style='background:#DC143C;padding:15px;border-radius:10px;text-align:center;color:white; margin-bottom: 5px;'>"
-                    f"<h4 style='margin:0;font-size:14px;'>⬇️ Total de Despesas</h4><h3 style='margin:0;font-size:20px;'>{format_currency(total_expense)}</h3></div>",
-                    unsafe_allow_html=True,
+            # Exibição das métricas em 3 colunas para preencher o espaço principal, num
+            # único st.markdown (flex com quebra de linha, como as colunas no celular)
+            cards = "".join(
+                f"<div style='flex:1 1 180px;background:{color};padding:15px;border-radius:10px;text-align:center;color:white; margin-bottom: 5px;'>"
+                f"<h4 style='margin:0;font-size:14px;'>{title}</h4><h3 style='margin:0;font-size:20px;'>{format_currency(amount)}</h3></div>"
+                for title, amount, color in (
+                    ("💰 Saldo Total", total_balance, "#2E8B57"),
+                    ("⬆️ Total de Receitas", total_income, "#1E90FF"),
+                    ("⬇️ Total de Despesas", total_expense, "#DC143C"),
                 )
+            )
+            st.markdown(f"<div style='display:flex;flex-wrap:wrap;gap:1rem;'>{cards}</div>", unsafe_allow_html=True)
             
             st.markdown("---")
             
             # --- GRÁFICO: EVOLUÇÃO CUMULATIVA (RECEITA, DESPESA E SALDO) ---
             st.caption("Evolução Cumulativa: Receitas, Despesas e Saldo")
 
-            # 1. Copiar e ordenar por Data (ascendente para o cumulativo)
-            df_plot = df.copy()
-            df_plot.sort_values(by="Data", ascending=True, inplace=True)
-            
-            # 2. Calcular Receita, Despesa e Saldo (Cumulativos)
-            df_plot['Receita_diaria'] = df_plot.apply(lambda x: x['Valor'] if x['Tipo'] == 'Receita' else 0, axis=1)
-            df_plot['Despesa_diaria'] = df_plot.apply(lambda x: x['Valor'] if x['Tipo'] == 'Despesa' else 0, axis=1)
-            
-            # Agrupar por data (para transações do mesmo dia) e calcular acumulados
-            df_grouped = df_plot.groupby("Data").agg({
-                "Receita_diaria": "sum",
-                "Despesa_diaria": "sum",
-                "Valor Ajustado": "sum"
-            }).reset_index()
-
-            # Calcular as somas acumuladas
-            df_grouped["Receita Acumulada"] = df_grouped["Receita_diaria"].cumsum()
-            df_grouped["Despesa Acumulada"] = df_grouped["Despesa_diaria"].cumsum()
-            df_grouped["Saldo Cumulativo"] = df_grouped["Valor Ajustado"].cumsum()
-            
-            # 3. Derreter (melt) os dados para plotar múltiplas linhas com Plotly Express
-            df_melt = df_grouped.melt(
-                id_vars=['Data'],
-                value_vars=['Receita Acumulada', 'Despesa Acumulada', 'Saldo Cumulativo'],
-                var_name='Métrica',
-                value_name='Valor'
-            )
-            
-            # Mapeamento de cores para consistência
-            color_map = {
-                'Receita Acumulada': '#1E90FF',  # Azul (Receita)
-                'Despesa Acumulada': '#DC143C',  # Vermelho (Despesa)
-                'Saldo Cumulativo': '#2E8B57'   # Verde (Saldo)
-            }
-
-            # 4. Criar o gráfico de linha
-            fig = px.line(
-                df_melt,
-                x="Data",
-                y="Valor",
-                color="Métrica", # Usa a métrica para diferenciar as linhas
-                title="Evolução Financeira Acumulativa",
-                markers=True,
-                color_discrete_map=color_map
-            )
-            
-            # Configurações de layout
-            fig.update_layout(
-                height=350, 
-                margin=dict(t=50, b=10, l=10, r=10),
-                xaxis_title="Data",
-                yaxis_title="Valor Acumulado (R$)",
-                hovermode="x unified"
-            )
-            
-            fig.update_traces(line=dict(width=3))
-            
+            # Receita, Despesa e Saldo acumulados por dia (figura em cache)
+            fig = cumulative_fig(data_key, df)
             st.plotly_chart(fig, use_container_width=True)
 
 
@@ -346,83 +824,26 @@ with main_col:
             st.info("Nenhuma transação registrada ainda. Use a barra lateral para ir em 'Lançamentos' e adicionar sua primeira transação.")
         else:
             
-            # --- Preparações para Gráficos ---
-            df_g = df.copy() # Cria uma cópia para evitar side effects
-            df_g["Ano"] = df_g["Data"].dt.year
-            month_names_pt_br = {
-                1: 'Jan', 2: 'Fev', 3: 'Mar', 4: 'Abr', 
-                5: 'Mai', 6: 'Jun', 7: 'Jul', 8: 'Ago', 
-                9: 'Set', 10: 'Out', 11: 'Nov', 12: 'Dez'
-            }
-            # Usa o month name e o número do mês para ordenação correta no plot
-            df_g["Mês_Num"] = df_g["Data"].dt.month
-            df_g["Mês"] = df_g["Data"].dt.month.map(month_names_pt_br)
-            monthly_balance = df_g.groupby(["Ano", "Mês_Num", "Mês", "Tipo"])["Valor"].sum().reset_index()
-            # Ordena pelo número do mês para o Plotly
-            monthly_balance.sort_values(by=["Ano", "Mês_Num"], inplace=True) 
-
             # Gráficos principais
             col_graph1, col_graph2 = st.columns([1, 1]) # Colunas internas para os gráficos
 
             with col_graph1:
                 # --- Gráfico de evolução mensal ---
-                month_order = [
-                    'Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-                    'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez'
-                ]
-                
-                fig = px.bar(
-                    monthly_balance,
-                    x="Mês",
-                    y="Valor",
-                    color="Tipo",
-                    barmode="group",
-                    facet_col="Ano",
-                    title="📈 Evolução Mensal (Receitas vs Despesas)",
-                    color_discrete_map={"Receita": "#1E90FF", "Despesa": "#DC143C"},
-                    category_orders={"Mês": month_order} 
-                )
-                fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10), uniformtext_minsize=8, uniformtext_mode='hide') # Diminui a altura
-                fig.update_yaxes(title_text="Valor (R$)") # Adiciona rótulo ao eixo Y
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(monthly_fig(data_key, df, "📈 Evolução Mensal (Receitas vs Despesas)"), use_container_width=True)
 
             with col_graph2:
                 # --- Gráficos de pizza para receitas e despesas ---
                 tab1, tab2 = st.tabs(["Receitas por Categoria", "Despesas por Categoria"])
                 
                 with tab1:
-                    income_df = df_g[df_g["Tipo"] == "Receita"]
-                    if not income_df.empty:
-                        summary = income_df.groupby("Categoria")["Valor"].sum().reset_index()
-                        fig = px.pie(
-                            summary,
-                            values="Valor",
-                            names="Categoria",
-                            title="Distribuição de Receitas",
-                            hole=0.3,
-                            color_discrete_sequence=px.colors.sequential.Blues
-                        )
-                        fig.update_traces(textinfo='percent+label') # Mostra porcentagem e rótulo no gráfico
-                        fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10)) # Diminui a altura
-                        st.plotly_chart(fig, use_container_width=True)
+                    if not category_agg(data_key, df, "Receita").empty:
+                        st.plotly_chart(category_fig(data_key, df, "Receita", "Distribuição de Receitas"), use_container_width=True)
                     else:
                         st.info("Nenhuma receita registrada.")
 
                 with tab2:
-                    expenses_df = df_g[df_g["Tipo"] == "Despesa"]
-                    if not expenses_df.empty:
-                        summary = expenses_df.groupby("Categoria")["Valor"].sum().reset_index()
-                        fig = px.pie(
-                            summary,
-                            values="Valor",
-                            names="Categoria",
-                            title="Distribuição de Despesas",
-                            hole=0.3,
-                            color_discrete_sequence=px.colors.sequential.Reds
-                        )
-                        fig.update_traces(textinfo='percent+label')
-                        fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10)) # Diminui a altura
-                        st.plotly_chart(fig, use_container_width=True)
+                    if not category_agg(data_key, df, "Despesa").empty:
+                        st.plotly_chart(category_fig(data_key, df, "Despesa", "Distribuição de Despesas"), use_container_width=True)
                     else:
                         st.info("Nenhuma despesa registrada.")
 
@@ -436,54 +857,38 @@ with main_col:
             # Submenu para tipos de análise
             col1, col2, col3, col4 = st.columns(4)
             
-            # --- Buttons ---
+            # --- Buttons --- (callbacks trocam o tipo antes do rerun do clique; o tipo atual fica desabilitado)
             with col1:
-                if st.button("🧾 Despesas", use_container_width=True, type="primary" if st.session_state.analise_tipo == "despesas" else "secondary"):
-                    st.session_state.analise_tipo = "despesas"
-                    st.rerun() 
+                st.button("🧾 Despesas", use_container_width=True, type="primary" if st.session_state.analise_tipo == "despesas" else "secondary",
+                          disabled=st.session_state.analise_tipo == "despesas", on_click=_set_state, args=("analise_tipo", "despesas"))
             with col2:
-                if st.button("💵 Receitas", use_container_width=True, type="primary" if st.session_state.analise_tipo == "receitas" else "secondary"):
-                    st.session_state.analise_tipo = "receitas"
-                    st.rerun() 
+                st.button("💵 Receitas", use_container_width=True, type="primary" if st.session_state.analise_tipo == "receitas" else "secondary",
+                          disabled=st.session_state.analise_tipo == "receitas", on_click=_set_state, args=("analise_tipo", "receitas"))
             with col3:
-                if st.button("📅 Mensal", use_container_width=True, type="primary" if st.session_state.analise_tipo == "mensal" else "secondary"):
-                    st.session_state.analise_tipo = "mensal"
-                    st.rerun() 
+                st.button("📅 Mensal", use_container_width=True, type="primary" if st.session_state.analise_tipo == "mensal" else "secondary",
+                          disabled=st.session_state.analise_tipo == "mensal", on_click=_set_state, args=("analise_tipo", "mensal"))
             with col4:
-                if st.button("📆 Anual", use_container_width=True, type="primary" if st.session_state.analise_tipo == "anual" else "secondary"):
-                    st.session_state.analise_tipo = "anual"
-                    st.rerun() 
+                st.button("📆 Anual", use_container_width=True, type="primary" if st.session_state.analise_tipo == "anual" else "secondary",
+                          disabled=st.session_state.analise_tipo == "anual", on_click=_set_state, args=("analise_tipo", "anual"))
 
             st.markdown("---")
 
-            df_a = df.copy()
             tipo = st.session_state.analise_tipo
 
             # 1️⃣ DESPESAS
             if tipo == "despesas":
                 st.caption("Distribuição de Despesas por Categoria")
-                expenses_df = df_a[df_a["Tipo"] == "Despesa"]
-                if not expenses_df.empty:
-                    summary = expenses_df.groupby("Categoria")["Valor"].sum().reset_index()
-                    fig = px.pie(
-                        summary,
-                        values="Valor",
-                        names="Categoria",
-                        hole=0.3,
-                        color_discrete_sequence=px.colors.sequential.Reds
-                    )
-                    fig.update_traces(textinfo='percent+label')
-                    fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10))
-                    st.plotly_chart(fig, use_container_width=True)
+                # Linhas do tipo separadas e formatadas uma vez por versão dos dados
+                df_display = tipo_detail(data_key, df, "Despesa")
+                if not df_display.empty:
+                    st.plotly_chart(category_fig(data_key, df, "Despesa"), use_container_width=True)
                     
                     st.caption("Detalhes das Despesas")
-                    # Cria um DataFrame para exibição com colunas formatadas
-                    df_display = expenses_df[["Data", "Categoria", "Valor", "Descrição"]].copy()
-                    df_display["Data"] = df_display["Data"].dt.strftime("%d/%m/%Y")
-                    df_display["Valor"] = df_display["Valor"].apply(format_currency)
-                    
-                    st.dataframe(df_display, 
+                    # Só o Valor vem formatado; a Data é formatada pelo navegador (column_config).
+                    # Só uma página de linhas vai para o navegador
+                    st.dataframe(paginate(df_display, "detail_page_despesas"), 
                                  column_order=["Data", "Categoria", "Valor", "Descrição"],
+                                 column_config={"Data": st.column_config.DateColumn(format="DD/MM/YYYY")},
                                  use_container_width=True, height=200) 
                 else:
                     st.info("Nenhuma despesa registrada.")
@@ -491,28 +896,17 @@ with main_col:
             # 2️⃣ RECEITAS
             elif tipo == "receitas":
                 st.caption("Distribuição de Receitas por Categoria")
-                income_df = df_a[df_a["Tipo"] == "Receita"]
-                if not income_df.empty:
-                    summary = income_df.groupby("Categoria")["Valor"].sum().reset_index()
-                    fig = px.pie(
-                        summary,
-                        values="Valor",
-                        names="Categoria",
-                        hole=0.3,
-                        color_discrete_sequence=px.colors.sequential.Blues
-                    )
-                    fig.update_traces(textinfo='percent+label')
-                    fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10))
-                    st.plotly_chart(fig, use_container_width=True)
+                # Linhas do tipo separadas e formatadas uma vez por versão dos dados
+                df_display = tipo_detail(data_key, df, "Receita")
+                if not df_display.empty:
+                    st.plotly_chart(category_fig(data_key, df, "Receita"), use_container_width=True)
                     
                     st.caption("Detalhes das Receitas")
-                    # Cria um DataFrame para exibição com colunas formatadas
-                    df_display = income_df[["Data", "Categoria", "Valor", "Descrição"]].copy()
-                    df_display["Data"] = df_display["Data"].dt.strftime("%d/%m/%Y")
-                    df_display["Valor"] = df_display["Valor"].apply(format_currency)
-                    
-                    st.dataframe(df_display, 
+                    # Só o Valor vem formatado; a Data é formatada pelo navegador (column_config).
+                    # Só uma página de linhas vai para o navegador
+                    st.dataframe(paginate(df_display, "detail_page_receitas"), 
                                  column_order=["Data", "Categoria", "Valor", "Descrição"],
+                                 column_config={"Data": st.column_config.DateColumn(format="DD/MM/YYYY")},
                                  use_container_width=True, height=200)
                 else:
                     st.info("Nenhuma receita registrada.")
@@ -520,49 +914,19 @@ with main_col:
             # 3️⃣ COMPARATIVO MENSAL
             elif tipo == "mensal":
                 st.caption("Comparativo Mensal (Receita x Despesa)")
-                df_a["Ano"] = df_a["Data"].dt.year
-                month_names_pt_br = {1: 'Jan', 2: 'Fev', 3: 'Mar', 4: 'Abr', 5: 'Mai', 6: 'Jun', 7: 'Jul', 8: 'Ago', 9: 'Set', 10: 'Out', 11: 'Nov', 12: 'Dez'}
-                df_a["Mês_Num"] = df_a["Data"].dt.month
-                df_a["Mês"] = df_a["Data"].dt.month.map(month_names_pt_br)
-                monthly_summary = df_a.groupby(["Ano", "Mês_Num", "Mês", "Tipo"])["Valor"].sum().reset_index()
-                monthly_summary.sort_values(by=["Ano", "Mês_Num"], inplace=True) 
-
-                month_order = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-                
+                monthly_summary = monthly_agg(data_key, df)
+
                 if not monthly_summary.empty:
-                    fig = px.bar(
-                        monthly_summary,
-                        x="Mês",
-                        y="Valor",
-                        color="Tipo",
-                        barmode="group",
-                        facet_col="Ano",
-                        color_discrete_map={"Receita": "#1E90FF", "Despesa": "#DC143C"},
-                        category_orders={"Mês": month_order} 
-                    )
-                    fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10), uniformtext_minsize=8, uniformtext_mode='hide')
-                    fig.update_yaxes(title_text="Valor (R$)") 
-                    st.plotly_chart(fig, use_container_width=True)
+                    st.plotly_chart(monthly_fig(data_key, df), use_container_width=True)
                 else:
                     st.info("Sem dados mensais para exibir.")
 
             # 4️⃣ COMPARATIVO ANUAL
             elif tipo == "anual":
                 st.caption("Comparativo Anual (Receita x Despesa)")
-                df_a["Ano"] = df_a["Data"].dt.year
-                yearly_summary = df_a.groupby(["Ano", "Tipo"])["Valor"].sum().reset_index()
+                yearly_summary = yearly_agg(data_key, df)
                 if not yearly_summary.empty:
-                    fig = px.bar(
-                        yearly_summary,
-                        x="Ano",
-                        y="Valor",
-                        color="Tipo",
-                        barmode="group",
-                        color_discrete_map={"Receita": "#1E90FF", "Despesa": "#DC143C"},
-                    )
-                    fig.update_layout(height=350, margin=dict(t=50, b=10, l=10, r=10), uniformtext_minsize=8, uniformtext_mode='hide')
-                    fig.update_yaxes(title_text="Valor (R$)") 
-                    st.plotly_chart(fig, use_container_width=True)
+                    st.plotly_chart(yearly_fig(data_key, df), use_container_width=True)
                 else:
                     st.info("Sem dados anuais para exibir.")
 
@@ -573,43 +937,6 @@ with main_col:
         if df.empty:
             st.info("Nenhuma transação registrada.")
         else:
-            # Prepara o DataFrame para exibição (com formatação e ID)
-            df_display = df.copy()
-            df_display.reset_index(inplace=True, drop=False) # Mantém o índice como coluna "ID"
-            df_display.rename(columns={"index": "ID"}, inplace=True)
-            
-            # Formatação das colunas para melhor visualização
-            df_display["Data"] = df_display["Data"].dt.strftime("%d/%m/%Y")
-            df_display["Valor"] = df_display["Valor"].apply(format_currency)
-
-            # Exibe o histórico de transações
-            st.dataframe(df_display[["ID", "Data", "Tipo", "Categoria", "Valor", "Descrição"]], 
-                         column_order=["ID", "Data", "Tipo", "Categoria", "Valor", "Descrição"],
-                         use_container_width=True, 
-                         height=250)
-
-            st.markdown("---")
-            
-            st.caption("🗑️ Excluir Transação")
-            
-            valid_ids = df_display["ID"].tolist()
-            
-            if valid_ids:
-                # Seleciona o ID do topo
-                selected_id = st.selectbox("Selecione o ID da transação:", valid_ids, index=0)
-                
-                selected_row = df_display.loc[df_display["ID"] == selected_id]
-                st.caption("Transação selecionada (Confirmação):")
-                # Exibe a transação selecionada para confirmação (altura menor)
-                st.dataframe(selected_row[["ID", "Data", "Tipo", "Categoria", "Valor", "Descrição"]], 
-                             use_container_width=True, 
-                             height=50)
-
-                if st.button("Excluir Transação", type="secondary", key="delete_button"):
-                    # O ID selecionado é o índice original no DataFrame do st.session_state
-                    st.session_state.df = delete_transaction(st.session_state.df, selected_id) 
-                    st.success("Transação excluída com sucesso!")
-                    st.rerun()
-            else:
-                st.info("Nenhuma transação disponível para exclusão.")
+            # Fragmento: paginação e seleção do ID reexecutam só esta seção
+            history_section(df, data_key)
 